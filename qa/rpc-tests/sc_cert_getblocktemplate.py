@@ -7,11 +7,13 @@ from test_framework.test_framework import BitcoinTestFramework
 from test_framework.authproxy import JSONRPCException
 from test_framework.util import assert_equal, initialize_chain_clean, \
     start_nodes, sync_blocks, sync_mempools, connect_nodes_bi, mark_logs,\
-    get_epoch_data, assert_false, swap_bytes
+    get_epoch_data, assert_false, swap_bytes, rpc_batch
 from test_framework.test_framework import ForkHeights
 from test_framework.mc_test.mc_test import CertTestUtils, generate_random_field_element_hex
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
+import os
 import time
 
 DEBUG_MODE = 1
@@ -21,23 +23,38 @@ FT_SC_FEE = Decimal('0')
 MBTR_SC_FEE = Decimal('0')
 CERT_FEE = Decimal('0.00015')
 
+# The delay is applied by increasing the mock time of the nodes, so it doesn't add any wall-clock time to the test
 BLOCK_TEMPLATE_DELAY = 5 + 1 # Seconds ("+1" due to the fact the getblocktemplate trigger condition is ">5")
 
+# (sidechain version, ceasable)
+SC_TEST_CASES = [(0, True), (2, True), (2, False)]
+
 class sc_cert_base(BitcoinTestFramework):
 
     def __init__(self):
         super().__init__()
         self.firstRound = True
+        # Verification keys already generated, indexed by the key rotation flag
+        self._vk_cache = {}
 
     def setup_chain(self):
         print("Initializing test directory " + self.options.tmpdir)
         initialize_chain_clean(self.options.tmpdir, NUMB_OF_NODES)
+        self.mcTest = CertTestUtils(self.options.tmpdir, self.options.srcdir)
+
+    def add_options(self, parser):
+        parser.add_option("--perf", dest="perf", default=False, action="store_true",
+                          help="Start the nodes without debug logging, to keep its cost out of the test timings")
 
     def setup_network(self, split=False):
         self.nodes = []
 
-        self.nodes = start_nodes(NUMB_OF_NODES, self.options.tmpdir, extra_args=
-            [['-debug=py', '-debug=sc', '-debug=mempool', '-debug=net', '-debug=cert', '-debug=zendoo_mc_cryptolib', '-scproofqueuesize=0', '-logtimemicros=1']] * NUMB_OF_NODES)
+        if self.options.perf:
+            extra_args = ['-scproofqueuesize=0']
+        else:
+            extra_args = ['-debug=py', '-debug=sc', '-debug=mempool', '-debug=net', '-debug=cert', '-debug=zendoo_mc_cryptolib', '-scproofqueuesize=0', '-logtimemicros=1']
+
+        self.nodes = start_nodes(NUMB_OF_NODES, self.options.tmpdir, extra_args=[extra_args] * NUMB_OF_NODES)
 
         connect_nodes_bi(self.nodes, 0, 1)
         connect_nodes_bi(self.nodes, 1, 2)
@@ -46,13 +63,36 @@ class sc_cert_base(BitcoinTestFramework):
         self.is_network_split = split
         self.sync_all()
 
+        # Each node has its own RPC connection, so calls to different nodes can be dispatched concurrently
+        self._pool = ThreadPoolExecutor(max_workers=NUMB_OF_NODES)
+
+    def check_block_templates(self, expected_certs, expected_txs, nodes = None):
+        '''
+        This function calls `getblocktemplate` on the given nodes (all nodes by default) and checks that
+        the returned templates contain the expected number of certificates and transactions.
+        The block templates are returned to allow further checks on them.
+        '''
+        nodes = self.nodes if nodes is None else nodes
+        block_templates = list(self._pool.map(lambda node: node.getblocktemplate(), nodes))
+        for block_template in block_templates:
+            assert_equal(len(block_template['certificates']), expected_certs)
+            assert_equal(len(block_template['transactions']), expected_txs)
+        return block_templates
+
+    def decode_certificates(self, block_template):
+        '''
+        This function decodes all the certificates included in a block template
+        with a single (batched) RPC call.
+        '''
+        raw_certificates = [raw_certificate["data"] for raw_certificate in block_template['certificates']]
+        return rpc_batch(self.nodes[0], "decoderawtransaction", [[raw] for raw in raw_certificates])
+
     def check_certificates_ordering_by_epoch(self, block_template, first_epoch) -> bool:
         '''
         This function checks that certificates for a non-ceasable sidechain submitted to mempool
         are correctly ordered by epoch.
         '''
-        for raw_certificate in block_template['certificates']:
-            certificate = self.nodes[0].decoderawtransaction(raw_certificate["data"])
+        for certificate in self.decode_certificates(block_template):
             assert_equal(certificate["cert"]["epochNumber"], first_epoch)
             first_epoch += 1
 
@@ -61,8 +101,7 @@ class sc_cert_base(BitcoinTestFramework):
         This function checks that certificates for a ceasable sidechain submitted to mempool
         are correctly ordered by quality.
         '''
-        for raw_certificate in block_template['certificates']:
-            certificate = self.nodes[0].decoderawtransaction(raw_certificate["data"])
+        for certificate in self.decode_certificates(block_template):
             assert_equal(certificate["cert"]["quality"], lowest_quality)
             lowest_quality += 1
 
@@ -91,8 +130,12 @@ class sc_cert_base(BitcoinTestFramework):
             self.firstRound = False
 
         #generate wCertVk and constant
-        mcTest = CertTestUtils(self.options.tmpdir, self.options.srcdir)
-        vk = mcTest.generate_params(sc_name, keyrot = True if scversion >= 2 else None)
+        # Sidechains with the same key rotation setting can share the proving system parameters,
+        # so they are generated only once and then referenced through the id they were created with
+        keyrot = True if scversion >= 2 else None
+        if keyrot not in self._vk_cache:
+            self._vk_cache[keyrot] = (sc_name, self.mcTest.generate_params(sc_name, keyrot = keyrot))
+        params_id, vk = self._vk_cache[keyrot]
         constant = generate_random_field_element_hex()
         cmdInput = {
             "version": scversion,
@@ -106,6 +149,8 @@ class sc_cert_base(BitcoinTestFramework):
         ret = self.nodes[0].sc_create(cmdInput)
         scid = ret['scid']
         scid_swapped = str(swap_bytes(scid))
+        # The creation transaction is mined with the next block
+        sc_creation_height = self.nodes[0].getblockcount() + 1
         mark_logs("Node 0 created a SC", self.nodes, DEBUG_MODE)
 
         nblocks = epoch_length if ceasable else 2
@@ -119,23 +164,24 @@ class sc_cert_base(BitcoinTestFramework):
 
         #Create proof for WCert
         quality = 10
-        proof = mcTest.create_test_proof(sc_name,
-                                         scid_swapped,
-                                         epoch_number,
-                                         quality,
-                                         MBTR_SC_FEE,
-                                         FT_SC_FEE,
-                                         epoch_cum_tree_hash,
-                                         prev_cert_hash = prev_cert_data_hash if scversion >= 2 else None,
-                                         constant       = constant,
-                                         pks            = [addr_node1],
-                                         amounts        = [bwt_amount])
+        proof = self.mcTest.create_test_proof(params_id,
+                                              scid_swapped,
+                                              epoch_number,
+                                              quality,
+                                              MBTR_SC_FEE,
+                                              FT_SC_FEE,
+                                              epoch_cum_tree_hash,
+                                              prev_cert_hash = prev_cert_data_hash if scversion >= 2 else None,
+                                              constant       = constant,
+                                              pks            = [addr_node1],
+                                              amounts        = [bwt_amount])
 
         amount_cert_1 = [{"address": addr_node1, "amount": bwt_amount}]
 
         cur_h = self.nodes[0].getblockcount()
-        ret = self.nodes[0].getscinfo(scid, True, False)['items'][0]
-        ceas_h = ret['ceasingHeight'] if ceasable else cur_h + 1
+        # No certificate has been received yet, so a ceasable sidechain ceases at the end of
+        # the submission window of epoch 0 (whose length is max(2, epoch_length / 5))
+        ceas_h = sc_creation_height + epoch_length + max(2, epoch_length // 5) - 1 if ceasable else cur_h + 1
         ceas_limit_delta = ceas_h - cur_h - 1
         mark_logs(f"Node 0 generating {ceas_limit_delta} blocks reaching the third to last block before the SC ceasing", self.nodes, DEBUG_MODE)
         self.nodes[0].generate(ceas_limit_delta - 2)
@@ -144,10 +190,7 @@ class sc_cert_base(BitcoinTestFramework):
         ### 1: Creating a transaction
         node2_address = self.nodes[2].getnewaddress()
         mark_logs("\nCall GetBlockTemplate on each node to create a new cached version; check it is empty", self.nodes, DEBUG_MODE)
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        self.check_block_templates(0, 0)
 
         mark_logs("Node 0 sends a transaction", self.nodes, DEBUG_MODE)
         self.nodes[0].sendtoaddress(node2_address, 0.1)
@@ -156,18 +199,12 @@ class sc_cert_base(BitcoinTestFramework):
         mark_logs("Check that the transaction is not immediately included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(1)
 
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        self.check_block_templates(0, 0)
 
         mark_logs(f"Mock waiting {BLOCK_TEMPLATE_DELAY} seconds and check that the transaction is now included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(BLOCK_TEMPLATE_DELAY)
 
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 1)
+        self.check_block_templates(0, 1)
 
         mark_logs("Node 0 mines one block to clean the mempool", self.nodes, DEBUG_MODE)
         self.nodes[0].generate(1)
@@ -175,11 +212,10 @@ class sc_cert_base(BitcoinTestFramework):
 
 
         ### 2: Creating a certificate
-        mark_logs("\nCall GetBlockTemplate on each node to create a new cached version; check it is empty", self.nodes, DEBUG_MODE)
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        # The caching behavior has already been checked on every node in the first section, from now on
+        # it is checked on node 0 only; the inclusion into the block template is still checked on every node.
+        mark_logs("\nCall GetBlockTemplate on node 0 to create a new cached version; check it is empty", self.nodes, DEBUG_MODE)
+        self.check_block_templates(0, 0, self.nodes[:1])
 
         mark_logs("Node 0 sends a certificate", self.nodes, DEBUG_MODE)
         try:
@@ -195,18 +231,12 @@ class sc_cert_base(BitcoinTestFramework):
         mark_logs("Check that the certificate is not immediately included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(1)
 
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        self.check_block_templates(0, 0, self.nodes[:1])
 
         mark_logs(f"Mock waiting {BLOCK_TEMPLATE_DELAY} seconds and check that the certificate is now included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(BLOCK_TEMPLATE_DELAY)
 
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 1)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        self.check_block_templates(1, 0)
 
         mark_logs("Node 0 mines one block to clean the mempool", self.nodes, DEBUG_MODE)
         self.nodes[0].generate(1)
@@ -218,16 +248,13 @@ class sc_cert_base(BitcoinTestFramework):
         # It is a time consuming operation, so may take more than BLOCK_TEMPLATE_DELAY seconds.
         quality += 1
         epoch_number, epoch_cum_tree_hash, prev_cert_data_hash = get_epoch_data(scid, self.nodes[0], epoch_length, not ceasable)
-        proof = mcTest.create_test_proof(
-            sc_name, scid_swapped, epoch_number, quality, MBTR_SC_FEE, FT_SC_FEE, epoch_cum_tree_hash,
+        proof = self.mcTest.create_test_proof(
+            params_id, scid_swapped, epoch_number, quality, MBTR_SC_FEE, FT_SC_FEE, epoch_cum_tree_hash,
             prev_cert_hash = prev_cert_data_hash if scversion >= 2 else None, constant = constant, pks = [addr_node1], amounts = [bwt_amount])
         node2_address = self.nodes[2].getnewaddress()
 
-        mark_logs("\nCall GetBlockTemplate on each node to create a new cached version; check it is empty", self.nodes, DEBUG_MODE)
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        mark_logs("\nCall GetBlockTemplate on node 0 to create a new cached version; check it is empty", self.nodes, DEBUG_MODE)
+        self.check_block_templates(0, 0, self.nodes[:1])
 
         mark_logs("Node 0 sends a transaction and a certificate", self.nodes, DEBUG_MODE)
         self.nodes[0].sendtoaddress(node2_address, 0.1, "", "", True)
@@ -245,31 +272,29 @@ class sc_cert_base(BitcoinTestFramework):
         mark_logs("Check that the transaction and the certificate are not immediately included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(1)
 
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 0)
-            assert_equal(len(blocktemplate['transactions']), 0)
+        self.check_block_templates(0, 0, self.nodes[:1])
 
         mark_logs(f"Mock waiting {BLOCK_TEMPLATE_DELAY} seconds and check that the transaction and the certificate are now included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(BLOCK_TEMPLATE_DELAY)
 
-        for i in range(0, NUMB_OF_NODES):
-            blocktemplate = self.nodes[i].getblocktemplate()
-            assert_equal(len(blocktemplate['certificates']), 1)
-            assert_equal(len(blocktemplate['transactions']), 1)
-
-        for i in range(0, NUMB_OF_NODES):
-            # Check that `getblocktemplate` doesn't include "merkleTree" and "scTxsCommitment" if not explicitly requested
-            gbt = self.nodes[i].getblocktemplate()
-            assert_false('merkleTree' in gbt)
-            assert_false('scTxsCommitment' in gbt)
-            gbt = self.nodes[i].getblocktemplate({}, False)
-            assert_false('merkleTree' in gbt)
-            assert_false('scTxsCommitment' in gbt)
-
-            # Check that `getblocktemplate` "merkleTree" and "scTxsCommitment" match `getblockmerkleroots`
-            gbt = self.nodes[i].getblocktemplate({}, True)
-            roots = self.nodes[i].getblockmerkleroots([gbt['coinbasetxn']['data']] + [x['data'] for x in gbt['transactions']], [x['data'] for x in gbt['certificates']])
+        default_gbts = self.check_block_templates(1, 1)
+
+        # Check that `getblocktemplate` doesn't include "merkleTree" and "scTxsCommitment" if not explicitly requested
+        # (the templates obtained without arguments are the ones just checked above)
+        no_roots_gbts = list(self._pool.map(lambda node: node.getblocktemplate({}, False), self.nodes))
+        for default_gbt, no_roots_gbt in zip(default_gbts, no_roots_gbts):
+            assert_equal(default_gbt.keys(), no_roots_gbt.keys())
+            assert_false('merkleTree' in default_gbt)
+            assert_false('scTxsCommitment' in default_gbt)
+
+        gbts = list(self._pool.map(lambda node: node.getblocktemplate({}, True), self.nodes))
+
+        # Check that `getblocktemplate` "merkleTree" and "scTxsCommitment" match `getblockmerkleroots`.
+        # The coinbase of each template pays a different node, so the roots must be computed for every template;
+        # being `getblockmerkleroots` a pure computation, node 0 does it for all of them with a single batched call.
+        all_roots = rpc_batch(self.nodes[0], "getblockmerkleroots",
+            [[[gbt['coinbasetxn']['data']] + [x['data'] for x in gbt['transactions']], [x['data'] for x in gbt['certificates']]] for gbt in gbts])
+        for gbt, roots in zip(gbts, all_roots):
             assert_equal(gbt['merkleTree'], roots['merkleTree'])
             assert_equal(gbt['scTxsCommitment'], roots['scTxsCommitment'])
 
@@ -281,18 +306,15 @@ class sc_cert_base(BitcoinTestFramework):
         ### 4: Check certificates ordering (by quality)
 
         num_certificates = 10
-        from_addresses = []
 
         # Send coins to be used as input for the next certificate to a new address.
         # This is done to avoid generating dependencies between certificates (e.g. the second certificate
         # spending as input the change output of the first one). The alternative would be to pick UTXOs
         # manually and then use the createrawtransaction RPC command.
-        for i in range(0, num_certificates):
-            addr = self.nodes[0].getnewaddress()
-            self.nodes[0].sendtoaddress(addr, bwt_amount + CERT_FEE)
-            from_addresses.append(addr)
-
-        self.sync_all()
+        # A single transaction with one output per address is enough, since each certificate spends its own output.
+        from_addresses = [self.nodes[0].getnewaddress() for _ in range(0, num_certificates)]
+        # No need to sync here: the transaction is mined by node 0 in the next step and reaches the other nodes with the blocks
+        self.nodes[0].sendmany("", {addr: bwt_amount + CERT_FEE for addr in from_addresses})
 
         # Note that for the non-ceasing scenario the epoch_length is set to 0
         blocks_to_generate = epoch_length
@@ -303,41 +325,49 @@ class sc_cert_base(BitcoinTestFramework):
 
         lowest_quality = quality + 1
 
+        # All the certificates refer to the same epoch: for ceasable sidechains the epoch data only depends
+        # on the chain, which doesn't change while the certificates are submitted to the mempool
+        epoch_number, epoch_cum_tree_hash, prev_cert_data_hash = get_epoch_data(scid, self.nodes[0], epoch_length, not ceasable)
+        cert_data = []
         for i in range(0, num_certificates):
-            epoch_number, epoch_cum_tree_hash, prev_cert_data_hash = get_epoch_data(scid, self.nodes[0], epoch_length, not ceasable)
-
             quality += 1
-
-            proof = mcTest.create_test_proof(sc_name,
-                                             scid_swapped,
-                                             epoch_number,
-                                             quality,
-                                             MBTR_SC_FEE,
-                                             FT_SC_FEE,
-                                             epoch_cum_tree_hash,
-                                             prev_cert_hash = prev_cert_data_hash if scversion >= 2 else None,
-                                             constant       = constant,
-                                             pks            = [addr_node1],
-                                             amounts        = [bwt_amount])
-
+            cert_data.append((epoch_number, quality, epoch_cum_tree_hash, prev_cert_data_hash))
+
+        def create_proof(data):
+            epoch_number, quality, epoch_cum_tree_hash, prev_cert_data_hash = data
+            return self.mcTest.create_test_proof(params_id,
+                                                 scid_swapped,
+                                                 epoch_number,
+                                                 quality,
+                                                 MBTR_SC_FEE,
+                                                 FT_SC_FEE,
+                                                 epoch_cum_tree_hash,
+                                                 prev_cert_hash = prev_cert_data_hash if scversion >= 2 else None,
+                                                 constant       = constant,
+                                                 pks            = [addr_node1],
+                                                 amounts        = [bwt_amount])
+
+        # Proofs don't depend on each other, so the (time consuming) proof generation can be run concurrently
+        with ThreadPoolExecutor(max_workers=min(num_certificates, os.cpu_count() or 1)) as proof_pool:
+            proofs = list(proof_pool.map(create_proof, cert_data))
+
+        # A single log mark for the whole phase, since each mark costs one RPC call per node
+        mark_logs(f"Node 0 sends {num_certificates} certificates", self.nodes, DEBUG_MODE)
+        for i, (epoch_number, quality, epoch_cum_tree_hash, _) in enumerate(cert_data):
             try:
-                mark_logs(f"Sending certificate {i + 1} / {num_certificates}...", self.nodes, DEBUG_MODE)
                 cert_epoch = self.nodes[0].sc_send_certificate(scid, epoch_number, quality, epoch_cum_tree_hash,
-                                proof, amount_cert_1, FT_SC_FEE, MBTR_SC_FEE, CERT_FEE, from_addresses[i])
+                                proofs[i], amount_cert_1, FT_SC_FEE, MBTR_SC_FEE, CERT_FEE, from_addresses[i])
                 assert(len(cert_epoch) > 0)
             except JSONRPCException as e:
                 errorString = e.error['message']
-                mark_logs(f"Send certificate failed with reason {errorString}", self.nodes, DEBUG_MODE)
+                mark_logs(f"Send certificate {i + 1} / {num_certificates} failed with reason {errorString}", self.nodes, DEBUG_MODE)
                 assert(False)
-            self.sync_all()
+        sync_mempools(self.nodes, 0.1) # syncing mempools only, because there is no need to check for blocks sync
 
         mark_logs(f"Mock waiting {BLOCK_TEMPLATE_DELAY} seconds and check that the certificates are now included into the block template", self.nodes, DEBUG_MODE)
         self.increase_mock_time(BLOCK_TEMPLATE_DELAY)
 
-        for i in range(0, NUMB_OF_NODES):
-            block_template = self.nodes[i].getblocktemplate()
-            assert_equal(len(block_template['certificates']), num_certificates)
-            assert_equal(len(block_template['transactions']), 0)
+        for block_template in self.check_block_templates(num_certificates, 0):
             self.check_certificates_ordering_by_quality(block_template, lowest_quality)
 
         mark_logs("Mine one block and sync to check that the block is valid", self.nodes, DEBUG_MODE)
@@ -346,12 +376,14 @@ class sc_cert_base(BitcoinTestFramework):
         self.sync_all()
 
     def run_test(self):
-        mark_logs("\n**SC version 0", self.nodes, DEBUG_MODE)
-        self.run_test_with_scversion(0)
-        mark_logs("\n**SC version 2 - ceasable SC", self.nodes, DEBUG_MODE)
-        self.run_test_with_scversion(2, True)
-        mark_logs("\n**SC version 2 - non-ceasable SC", self.nodes, DEBUG_MODE)
-        self.run_test_with_scversion(2, False)
+        # The cases can't share the sidechain lifecycle: each one needs to be the only sidechain
+        # with certificates in the mempool (the block template content is checked exactly) and
+        # a ceasable sidechain would cease while waiting for the other cases to complete.
+        for (scversion, ceasable) in SC_TEST_CASES:
+            mark_logs(f"\n**SC version {scversion} - {'ceasable' if ceasable else 'non-ceasable'} SC", self.nodes, DEBUG_MODE)
+            self.run_test_with_scversion(scversion, ceasable)
+
+        self._pool.shutdown()
 
 
 if __name__ == '__main__':
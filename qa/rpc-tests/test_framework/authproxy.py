@@ -99,16 +99,22 @@ class AuthServiceProxy(object):
             self.__conn = httplib.HTTPConnection(self.__url.hostname, port, timeout)
 
         self.__ws_proxy = WsServiceProxy(ws_url, self.__service_name)
+        self.__callables = {}
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
             # Python internal stuff
             raise AttributeError
-        if self.__service_name is not None:
-            name = "%s.%s" % (self.__service_name, name)
-
-        wsurl = self.__ws_proxy.get_wsurl()
-        return AuthServiceProxy(self.__service_url, name, connection=self.__conn, ws_url=wsurl)
+        # Callables are stateless apart from the shared connection, so they are created only once
+        # per method name instead of re-parsing the service URL at every call
+        if name not in self.__callables:
+            service_name = name
+            if self.__service_name is not None:
+                service_name = "%s.%s" % (self.__service_name, name)
+
+            wsurl = self.__ws_proxy.get_wsurl()
+            self.__callables[name] = AuthServiceProxy(self.__service_url, service_name, connection=self.__conn, ws_url=wsurl)
+        return self.__callables[name]
 
 
     def _request(self, method, path, postdata):
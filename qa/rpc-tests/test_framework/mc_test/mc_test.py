@@ -107,7 +107,7 @@ class CertTestUtils(MCTestUtils):
         if not os.path.isfile(params_dir + file_prefix + "test_pk") or not os.path.isfile(params_dir + file_prefix + "test_vk"):
             return
 
-        proof_path = "{}_epoch_{}_{}_proof".format(self._get_proofs_dir(id), epoch_number, file_prefix)
+        proof_path = "{}_epoch_{}_quality_{}_{}_proof".format(self._get_proofs_dir(id), epoch_number, quality, file_prefix)
         args = self._get_args("create", circ_type, constant, prev_cert_hash, self.ps_type, params_dir, num_constraints, segment_size, proof_path)
 
         if prev_cert_hash is None:
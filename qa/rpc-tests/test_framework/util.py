@@ -83,9 +83,6 @@ def hex_str_to_str(hex_str):
 def str_to_b64str(string):
     return b64encode(string.encode('utf-8')).decode('ascii')
 
-def swap_bytes(input_buf):
-    return codecs.encode(codecs.decode(input_buf, 'hex')[::-1], 'hex').decode()
-
 def sync_blocks(rpc_connections, wait=1, p=False, limit_loop=0):
     """
     Wait until everybody has the same block count or a limit has been exceeded
@@ -126,6 +123,21 @@ def sync_mempools(rpc_connections, wait=1):
             break
         time.sleep(wait)
 
+def rpc_batch(node, method, params_list):
+    """
+    Call 'method' on 'node' once for each entry of 'params_list' using a single JSON-RPC batch request.
+    Returns the list of results, in the same order as 'params_list'
+    """
+    responses = node._batch([{'version': '1.1', 'method': method, 'params': params, 'id': i}
+                             for i, params in enumerate(params_list)])
+    results = []
+    for response in sorted(responses, key=lambda r: r['id']):
+        if response['error'] is not None:
+            raise JSONRPCException(response['error'])
+        results.append(response['result'])
+    assert_equal(len(results), len(params_list))
+    return results
+
 
 bitcoind_processes = {}
 
@@ -734,7 +746,7 @@ def advance_epoch(mcTest, node, sync_call,
     return cert, epoch_number
 
 def swap_bytes(input_buf):
-    return codecs.encode(codecs.decode(input_buf, 'hex')[::-1], 'hex').decode()
+    return unhexlify(input_buf)[::-1].hex()
 
 def get_total_amount_from_listaddressgroupings(input_list):
     '''